@@ -0,0 +1,97 @@
+"""Synthetic media corpus generated from ffmpeg lavfi sources.
+
+Files are written once into the corpus directory and reused by later runs:
+
+    python benchmarks/corpus.py --corpus quick --dir /tmp/botq_corpus
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import FFMPEG_BIN, FFmpegEngine
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), 'botq_corpus')
+
+X264 = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p']
+
+
+def cbr(bitrate: str) -> list:
+    """Constant bitrate with filler data, so the file reaches its intended size."""
+    return ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-b:v', bitrate,
+            '-minrate', bitrate, '-maxrate', bitrate, '-bufsize', bitrate, '-x264-params', 'nal-hrd=cbr:force-cfr=1']
+
+
+# name, resolution, duration in seconds, video args, audio args
+CORPUS = {
+    'quick': [
+        ('h264_aac_720p_20s.mp4', '1280x720', 20, X264 + ['-movflags', '+faststart'], ['-c:a', 'aac']),
+        ('h264_aac_1080p_30s_moov_end.mp4', '1920x1080', 30, X264, ['-c:a', 'aac']),
+        ('hevc_aac_1080p_20s.mkv', '1920x1080', 20, ['-c:v', 'libx265', '-preset', 'fast', '-pix_fmt', 'yuv420p'],
+         ['-c:a', 'aac']),
+        ('vp9_opus_480p_20s.webm', '854x480', 20,
+         ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-b:v', '1M'], ['-c:a', 'libopus']),
+        ('mpeg4_mp3_480p_20s.avi', '854x480', 20, ['-c:v', 'mpeg4', '-q:v', '5'], ['-c:a', 'libmp3lame']),
+    ],
+}
+CORPUS['full'] = CORPUS['quick'] + [
+    ('h264_aac_2160p_60s.mp4', '3840x2160', 60, X264 + ['-movflags', '+faststart'], ['-c:a', 'aac']),
+    ('h264_aac_720p_20min.mp4', '1280x720', 1200, X264 + ['-movflags', '+faststart'], ['-c:a', 'aac']),
+    ('h264_aac_1080p_500mb.mp4', '1920x1080', 100, cbr('40M'), ['-c:a', 'aac']),
+    ('h264_aac_2160p_2gb.mp4', '3840x2160', 90, cbr('180M'), ['-c:a', 'aac']),
+]
+
+
+async def generate(path: str, resolution: str, duration: float, video_args: list, audio_args: list) -> None:
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={resolution}:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(duration), '-g', '60', *video_args, *audio_args,
+        '-f', os.path.splitext(path)[1].lstrip('.').replace('mkv', 'matroska'), path + '.part'
+    )
+    if await process.wait() != 0:
+        raise RuntimeError(f"ffmpeg could not generate {os.path.basename(path)}")
+    os.replace(path + '.part', path)
+
+
+async def build(corpus: str = 'quick', directory: str = DEFAULT_DIR) -> list:
+    """Generate missing corpus files and return their probed descriptions."""
+    os.makedirs(directory, exist_ok=True)
+    engine = FFmpegEngine()
+    items = []
+    for name, resolution, duration, video_args, audio_args in CORPUS[corpus]:
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            print(f"Generating {name}...", file=sys.stderr)
+            try:
+                await generate(path, resolution, duration, video_args, audio_args)
+            except RuntimeError as e:
+                # e.g. an ffmpeg build without libx265
+                print(f"Skipping: {e}", file=sys.stderr)
+                continue
+        info = await engine.probe(path)
+        video = next(stream for stream in info['streams'] if stream.get('codec_type') == 'video')
+        items.append({
+            'name': name,
+            'path': path,
+            'file_name': name,
+            'file_size': os.path.getsize(path),
+            'duration': engine.duration(info),
+            'width': video.get('width', 0),
+            'height': video.get('height', 0),
+            'codec': video.get('codec_name'),
+        })
+    return items
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', choices=sorted(CORPUS), default='quick')
+    parser.add_argument('--dir', default=DEFAULT_DIR)
+    args = parser.parse_args()
+    for item in asyncio.run(build(args.corpus, args.dir)):
+        print(f"{item['name']:>36} {item['file_size'] / 1024 ** 2:>9.1f} MB {item['duration']:>7.1f}s {item['codec']}")
@@ -0,0 +1,198 @@
+"""End-to-end throughput benchmark: corpus files through the full bot pipeline.
+
+Every corpus file is sent from its own chat through a local Bot API stand-in,
+the menus are clicked through and the run ends when the result is uploaded.
+Reports jobs per minute, per-stage latency percentiles, CPU efficiency, peak
+memory and peak scratch disk usage for each action:
+
+    python benchmarks/e2e.py --corpus quick --repeat 2 --json e2e.json
+    python benchmarks/e2e.py --transport http --actions compress
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+
+API_PORT = 18091
+BOT_HTTP_PORT = 18090
+
+# name -> callback data clicked after the action menu appears
+ACTION_FLOWS = {
+    'format': ['format', 'format_mkv'],
+    'compress': ['compress', 'compress_medium'],
+    'resolution': ['resolution', 'res_480'],
+    'quick_mp4': ['quick_mp4'],
+}
+RESULT_KINDS = ('video', 'animation', 'document', 'audio', 'media_group')
+
+
+def percentiles(samples) -> dict:
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))], 2)
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+
+def cpu_seconds() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+async def drive_job(api, chat_id: int, file_id: str, item: dict, flow: list) -> dict:
+    """Send one video, click through flow and wait for the upload or an error."""
+    def menu(method, parameters):
+        return method == 'edit' and 'reply_markup' in parameters
+
+    def finished(method, parameters):
+        return method in RESULT_KINDS or (method == 'edit' and str(parameters.get('text', '')).startswith('❌'))
+
+    started = time.perf_counter()
+    start = len(api.calls.get(chat_id, []))
+    # A fresh file_unique_id per job keeps the result cache out of the measurement
+    api.enqueue([video_update(api.next_update_id(), chat_id, file_id, uuid.uuid4().hex, item)])
+    index, call = await api.wait_call(chat_id, menu, start)
+    message_id = call[3]['message_id']
+    for step, data in enumerate(flow):
+        api.enqueue([callback_update(api.next_update_id(), chat_id, message_id, data)])
+        if step < len(flow) - 1:
+            index, call = await api.wait_call(chat_id, menu, index + 1)
+    index, call = await api.wait_call(chat_id, finished, index + 1)
+    result = call[3] if call[1] in RESULT_KINDS else None
+    media = result.get(call[1], {}) if isinstance(result, dict) else {}
+    return {
+        'file': item['name'],
+        'ok': result is not None,
+        'seconds': call[0] - started,
+        'output_bytes': media.get('file_size', 0),
+    }
+
+
+async def sample_peaks(bot, peaks: dict, interval: float = 0.25) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        peaks['rss'] = max(peaks['rss'], process_rss())
+        peaks['disk'] = max(peaks['disk'], await loop.run_in_executor(None, bot.scratch.usage))
+        await asyncio.sleep(interval)
+
+
+async def run_action(api, bot, action: str, corpus: list, repeat: int, chat_base: int) -> dict:
+    bot.metrics = Metrics()
+    peaks = {'rss': 0, 'disk': 0}
+    sampler = asyncio.create_task(sample_peaks(bot, peaks))
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    jobs = [
+        drive_job(api, chat_base + index, f'corpus_{position}', item, ACTION_FLOWS[action])
+        for index, (position, item) in enumerate(
+            (position, item) for _ in range(repeat) for position, item in enumerate(corpus)
+        )
+    ]
+    results = await asyncio.gather(*jobs)
+    wall = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu_before
+    sampler.cancel()
+    media_seconds = repeat * sum(item['duration'] for item in corpus)
+    completed = [result for result in results if result['ok']]
+    return {
+        'action': action,
+        'jobs': len(results),
+        'failed': len(results) - len(completed),
+        'failed_files': sorted({result['file'] for result in results if not result['ok']}),
+        'wall_seconds': round(wall, 1),
+        'jobs_per_minute': round(len(completed) / wall * 60, 2),
+        'media_seconds_per_second': round(media_seconds / wall, 2),
+        'latency_seconds': {
+            'end_to_end': percentiles(result['seconds'] for result in completed),
+            **{stage: percentiles(bot.metrics.stage_seconds[stage].recent) for stage in Metrics.STAGES},
+        },
+        'cpu_seconds': round(cpu, 1),
+        # 1.0 means every core was busy for the whole run
+        'cpu_efficiency': round(cpu / (wall * (os.cpu_count() or 1)), 3),
+        'peak_rss_mb': round(peaks['rss'] / 1024 ** 2, 1),
+        'peak_child_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'peak_scratch_mb': round(peaks['disk'] / 1024 ** 2, 1),
+        'bytes_in': bot.metrics.bytes_in,
+        'bytes_out': bot.metrics.bytes_out,
+    }
+
+
+async def main(args) -> list:
+    corpus = await build_corpus(args.corpus, args.corpus_dir)
+    skipped = [item['name'] for item in corpus if item['file_size'] > MAX_FILE_SIZE]
+    corpus = [item for item in corpus if item['file_size'] <= MAX_FILE_SIZE]
+    if skipped:
+        print(f"Skipping files above {format_size(MAX_FILE_SIZE)}: {', '.join(skipped)}", file=sys.stderr)
+
+    api = FakeBotAPI(API_PORT, args.api_delay, local_mode=args.transport == 'local')
+    for position, item in enumerate(corpus):
+        api.add_file(f'corpus_{position}', item['path'])
+    await api.start()
+    bot = VideoConverterBot(TOKEN, base_url=api.base_url, local_mode=args.transport == 'local')
+    application = bot.application
+    results = []
+    try:
+        await application.initialize()
+        await bot.post_init(application)
+        await application.updater.start_polling(poll_interval=0.0, timeout=1)
+        await application.start()
+        for number, action in enumerate(args.actions):
+            print(f"Running {action} over {len(corpus) * args.repeat} jobs...", file=sys.stderr)
+            result = await run_action(api, bot, action, corpus, args.repeat, 100_000 * (number + 1))
+            result['transport'] = args.transport
+            results.append(result)
+        await application.updater.stop()
+        await application.stop()
+        await bot.post_shutdown(application)
+        await application.shutdown()
+    finally:
+        await api.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', choices=('quick', 'full'), default='quick')
+    parser.add_argument('--corpus-dir', help='where generated corpus files are kept between runs')
+    parser.add_argument('--repeat', type=int, default=1, help='copies of the corpus submitted per action')
+    parser.add_argument('--actions', nargs='+', choices=sorted(ACTION_FLOWS), default=list(ACTION_FLOWS))
+    parser.add_argument('--transport', choices=('local', 'http'), default='local',
+                        help='local Bot API server (files read in place) or public API (files downloaded over HTTP)')
+    parser.add_argument('--api-delay', type=float, default=0.05, help='simulated Bot API round trip in seconds')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    # The bot reads its settings at import time
+    os.environ.setdefault('TEMP_DIR', tempfile.mkdtemp(prefix='botq_e2e_'))
+    os.environ.setdefault('JOB_JOURNAL_PATH', os.path.join(tempfile.mkdtemp(prefix='botq_journal_'), 'jobs.db'))
+    os.environ['METRICS_PORT'] = str(BOT_HTTP_PORT)
+    os.environ['BOT_API_LOCAL_MODE'] = '1' if args.transport == 'local' else '0'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from corpus import DEFAULT_DIR, build as build_corpus
+    from fake_bot_api import TOKEN, FakeBotAPI, callback_update, video_update
+    from bot import MAX_FILE_SIZE, Metrics, VideoConverterBot, format_size, process_rss
+
+    args.corpus_dir = args.corpus_dir or DEFAULT_DIR
+    results = asyncio.run(main(args))
+    print(f"{'action':>10} {'jobs':>5} {'fail':>5} {'jobs/min':>9} {'e2e p50':>8} {'e2e p95':>8} "
+          f"{'enc p95':>8} {'cpu eff':>8} {'rss MB':>7} {'disk MB':>8}")
+    for result in results:
+        latency = result['latency_seconds']
+        print(f"{result['action']:>10} {result['jobs']:>5} {result['failed']:>5} {result['jobs_per_minute']:>9} "
+              f"{latency['end_to_end'].get('p50', '-'):>8} {latency['end_to_end'].get('p95', '-'):>8} "
+              f"{latency['encode'].get('p95', '-'):>8} {result['cpu_efficiency']:>8} "
+              f"{result['peak_rss_mb']:>7} {result['peak_scratch_mb']:>8}")
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
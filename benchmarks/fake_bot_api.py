@@ -0,0 +1,370 @@
+"""Local stand-in for the Telegram Bot API used by the benchmarks.
+
+Serves just enough of the API for VideoConverterBot to run against it:
+getUpdates long polling and webhook pushes, getFile with either local
+paths (local Bot API server mode) or a streaming file endpoint, sendVideo
+uploads, and message edits. Every call the bot makes is recorded per chat
+so a benchmark can wait for the bot's answers and time them.
+"""
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import os
+import time
+from urllib.parse import parse_qs, unquote
+
+TOKEN = '123456:BENCHMARK'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+CHUNK_SIZE = 1024 * 1024
+
+
+def parse_parameters(body: bytes, content_type: str) -> dict:
+    """Decode the form-encoded or multipart parameters python-telegram-bot sends."""
+    parameters = {}
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename():
+                parameters[name] = {'filename': part.get_filename(), 'size': len(payload)}
+            else:
+                parameters[name] = payload.decode()
+    else:
+        for key, values in parse_qs(body.decode()).items():
+            parameters[key] = values[-1]
+    for key, value in parameters.items():
+        if isinstance(value, str):
+            try:
+                parameters[key] = json.loads(value)
+            except ValueError:
+                pass
+    return parameters
+
+
+def user(chat_id: int) -> dict:
+    return {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'}
+
+
+def text_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': user(chat_id),
+            'text': text,
+        },
+    }
+
+
+def video_update(update_id: int, chat_id: int, file_id: str, file_unique_id: str, info: dict) -> dict:
+    """A video message as Telegram sends it; info holds file_size, duration, width, height and file_name."""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': user(chat_id),
+            'video': {
+                'file_id': file_id,
+                'file_unique_id': file_unique_id,
+                'file_size': info['file_size'],
+                'duration': int(info.get('duration', 0)),
+                'width': info.get('width', 0),
+                'height': info.get('height', 0),
+                'file_name': info.get('file_name', 'video.mp4'),
+                'mime_type': 'video/mp4',
+            },
+        },
+    }
+
+
+def callback_update(update_id: int, chat_id: int, message_id: int, data: str) -> dict:
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user(chat_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'menu',
+            },
+        },
+    }
+
+
+class FakeBotAPI:
+    """Bot API stand-in with update delivery, file serving and per-chat call recording."""
+
+    def __init__(self, port: int, api_delay: float = 0.05, local_mode: bool = False):
+        self.port = port
+        self.api_delay = api_delay
+        self.local_mode = local_mode
+        self.server = None
+        self.files = {}
+        self.pending = []
+        self.delivered = {}
+        self.replied = {}
+        self.calls = {}
+        self.webhook_url = None
+        self.webhook_set = asyncio.Event()
+        self._updates_changed = asyncio.Event()
+        self._calls_changed = asyncio.Event()
+        self._message_ids = itertools.count(1_000_000)
+        self._update_ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def methods(self) -> dict:
+        return {
+            'getMe': self.get_me,
+            'getUpdates': self.get_updates,
+            'setWebhook': self.set_webhook,
+            'deleteWebhook': self.delete_webhook,
+            'getFile': self.get_file,
+            'sendMessage': self.send_message,
+            'editMessageText': self.send_message,
+            'sendVideo': self.send_media,
+            'sendAudio': self.send_media,
+            'sendAnimation': self.send_media,
+            'sendDocument': self.send_media,
+            'sendMediaGroup': self.send_media_group,
+            'deleteMessage': self.acknowledge,
+            'answerCallbackQuery': self.acknowledge,
+        }
+
+    def next_update_id(self) -> int:
+        return next(self._update_ids)
+
+    def add_file(self, file_id: str, path: str) -> None:
+        """Make a file on disk available through getFile."""
+        self.files[file_id] = path
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', self.port)
+
+    async def stop(self) -> None:
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader, writer) -> None:
+        try:
+            method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+
+            if method == 'GET' and path.startswith(f'/file/bot{TOKEN}/'):
+                await self._send_file(writer, unquote(path[len(f'/file/bot{TOKEN}/'):]))
+                return
+            handler = self.methods().get(path.rsplit('/', 1)[-1]) if path.startswith(f'/bot{TOKEN}/') else None
+            if handler is None:
+                payload = {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+            else:
+                parameters = parse_parameters(body, headers.get('content-type', ''))
+                payload = {'ok': True, 'result': await handler(parameters)}
+            data = json.dumps(payload).encode()
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                "Connection: close\r\n\r\n".encode() + data
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_file(self, writer, file_path: str) -> None:
+        """Stream a corpus file the way api.telegram.org/file/ does."""
+        path = self.files.get(file_path)
+        if path is None or not os.path.isfile(path):
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return
+        writer.write(
+            f"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+            f"Content-Length: {os.path.getsize(path)}\r\nConnection: close\r\n\r\n".encode()
+        )
+        with open(path, 'rb') as source:
+            while True:
+                chunk = await asyncio.to_thread(source.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+
+    # Update delivery
+
+    def enqueue(self, updates: list) -> None:
+        """Make updates available to getUpdates."""
+        self.pending.extend(updates)
+        self._updates_changed.set()
+
+    async def push(self, updates: list, connections: int = 40) -> None:
+        """POST updates to the registered webhook, like Telegram with max_connections."""
+        await self.webhook_set.wait()
+        limit = asyncio.Semaphore(connections)
+        host, _, rest = self.webhook_url.split('://', 1)[1].partition(':')
+        port, _, path = rest.partition('/')
+
+        async def post(update):
+            async with limit:
+                body = json.dumps(update).encode()
+                reader, writer = await asyncio.open_connection(host, int(port))
+                self._mark_delivered(update)
+                writer.write(
+                    f"POST /{path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+                await reader.read()
+                writer.close()
+
+        await asyncio.gather(*(post(update) for update in updates))
+
+    def _mark_delivered(self, update: dict) -> None:
+        message = update.get('message') or update['callback_query']['message']
+        self.delivered.setdefault(message['chat']['id'], time.perf_counter())
+
+    # Call recording
+
+    def _record(self, method: str, parameters: dict, result) -> None:
+        chat_id = int(parameters.get('chat_id') or 0)
+        self.calls.setdefault(chat_id, []).append((time.perf_counter(), method, parameters, result))
+        self._calls_changed.set()
+        self._calls_changed = asyncio.Event()
+
+    async def wait_call(self, chat_id: int, predicate, start: int = 0, timeout: float = 3600):
+        """Wait for a recorded call of the chat (from index start) matching predicate(method, parameters)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            calls = self.calls.get(chat_id, [])
+            for index in range(start, len(calls)):
+                if predicate(calls[index][1], calls[index][2]):
+                    return index, calls[index]
+            changed = self._calls_changed
+            await asyncio.wait_for(changed.wait(), max(0.0, deadline - time.monotonic()))
+
+    async def wait_replies(self, count: int, timeout: float = 120) -> None:
+        deadline = time.monotonic() + timeout
+        while len(self.replied) < count:
+            changed = self._calls_changed
+            await asyncio.wait_for(changed.wait(), max(0.0, deadline - time.monotonic()))
+
+    def latencies(self) -> list:
+        return sorted(self.replied[chat] - self.delivered[chat] for chat in self.replied if chat in self.delivered)
+
+    def _message(self, chat_id: int, parameters: dict, **extra) -> dict:
+        message = {
+            'message_id': int(parameters.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    # Bot API methods
+
+    async def get_me(self, parameters: dict):
+        return BOT_USER
+
+    async def get_updates(self, parameters: dict):
+        offset = int(parameters.get('offset') or 0)
+        timeout = float(parameters.get('timeout') or 0)
+        self.pending = [update for update in self.pending if update['update_id'] >= offset]
+        if not self.pending and timeout:
+            self._updates_changed.clear()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self.pending[:100]
+        for update in batch:
+            self._mark_delivered(update)
+        return batch
+
+    async def set_webhook(self, parameters: dict):
+        self.webhook_url = parameters['url']
+        self.webhook_set.set()
+        return True
+
+    async def delete_webhook(self, parameters: dict):
+        self.webhook_url = None
+        return True
+
+    async def get_file(self, parameters: dict):
+        file_id = parameters['file_id']
+        path = self.files[file_id]
+        return {
+            'file_id': file_id,
+            'file_unique_id': f'unique_{file_id}',
+            'file_size': os.path.getsize(path),
+            # A local server answers with the path on disk, the public API with a download path
+            'file_path': os.path.abspath(path) if self.local_mode else file_id,
+        }
+
+    async def acknowledge(self, parameters: dict):
+        await asyncio.sleep(self.api_delay)
+        self._record('ack', parameters, True)
+        return True
+
+    async def send_message(self, parameters: dict):
+        await asyncio.sleep(self.api_delay)
+        chat_id = int(parameters['chat_id'])
+        self.replied.setdefault(chat_id, time.perf_counter())
+        message = self._message(chat_id, parameters, text=parameters.get('text', ''))
+        self._record('edit' if 'message_id' in parameters else 'message', parameters, message)
+        return message
+
+    async def send_media(self, parameters: dict):
+        await asyncio.sleep(self.api_delay)
+        chat_id = int(parameters['chat_id'])
+        kind = next(key for key in ('video', 'audio', 'animation', 'document') if key in parameters)
+        media = parameters[kind]
+        if isinstance(media, str) and media.startswith('file://'):
+            size = os.path.getsize(unquote(media[len('file://'):]))
+        elif isinstance(media, dict):
+            size = media['size']
+        else:
+            # attach:// reference to a multipart field, or a file_id being resent
+            size = next((value['size'] for value in parameters.values() if isinstance(value, dict)), 0)
+        file_id = f'result_{next(self._message_ids)}'
+        message = self._message(chat_id, parameters, caption=parameters.get('caption', ''), **{
+            kind: {'file_id': file_id, 'file_unique_id': f'unique_{file_id}', 'file_size': size,
+                   'duration': int(parameters.get('duration') or 0),
+                   'width': int(parameters.get('width') or 0), 'height': int(parameters.get('height') or 0)},
+        })
+        self._record(kind, parameters, message)
+        return message
+
+    async def send_media_group(self, parameters: dict):
+        await asyncio.sleep(self.api_delay)
+        chat_id = int(parameters['chat_id'])
+        messages = []
+        for item in parameters.get('media', []):
+            file_id = f'result_{next(self._message_ids)}'
+            messages.append(self._message(chat_id, {}, **{
+                item.get('type', 'video'): {'file_id': file_id, 'file_unique_id': f'unique_{file_id}'}
+            }))
+        self._record('media_group', parameters, messages)
+        return messages
@@ -0,0 +1,122 @@
+"""Throughput/size trade-off of the load-adaptive encoder levels on the synthetic corpus.
+
+Every level of ENCODER_LEVELS compresses the corpus with the 'medium' profile,
+running as many jobs side by side as the policy would give it encode slots:
+
+    python benchmarks/preset_tradeoff.py --corpus quick --repeat 2 --json tradeoff.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import DEFAULT_DIR, build as build_corpus
+from bot import AAC_ARGS, COMPRESSION_PROFILES, ENCODER_LEVELS, FFMPEG_BIN, H264_ARGS, EncoderPolicy, FFmpegEngine
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def ssim(source: str, encoded: str) -> float:
+    """Mean SSIM of the encode against its source (1.0 = identical)."""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, '-hide_banner', '-nostats', '-i', encoded, '-i', source,
+        '-lavfi', '[0:v][1:v]ssim', '-f', 'null', '-',
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    for line in stderr.decode(errors='replace').splitlines():
+        if 'All:' in line:
+            return float(line.split('All:')[1].split()[0])
+    return 0.0
+
+
+async def run_level(engine: FFmpegEngine, policy: EncoderPolicy, level: int, corpus: list,
+                    repeat: int, work_dir: str, measure_ssim: bool) -> dict:
+    policy.level = level
+    _, crf = COMPRESSION_PROFILES['medium']
+    slots = asyncio.Semaphore(policy.slots)
+    outputs = []
+
+    async def encode(index: int, item: dict) -> None:
+        output_path = os.path.join(work_dir, f'level{level}_{index}.mp4')
+        args = policy.apply(H264_ARGS + ['-crf', str(crf)]) + AAC_ARGS + ['-movflags', '+faststart', output_path]
+        async with slots:
+            await engine.run(['-i', item['path']] + args)
+        outputs.append((item, output_path))
+
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        encode(index, item) for index, item in enumerate(item for _ in range(repeat) for item in corpus)
+    ))
+    wall = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu_before
+
+    media_seconds = repeat * sum(item['duration'] for item in corpus)
+    result = {
+        'level': level,
+        'preset': policy.preset,
+        'crf': crf + policy.crf_offset,
+        'threads_per_job': policy.threads,
+        'slots': policy.slots,
+        'wall_seconds': round(wall, 2),
+        'jobs_per_minute': round(len(outputs) / wall * 60, 2),
+        'realtime_factor': round(media_seconds / wall, 2),
+        'cpu_seconds': round(cpu, 1),
+        'output_mb': round(sum(os.path.getsize(path) for _, path in outputs) / 1024 ** 2, 2),
+    }
+    if measure_ssim:
+        scores = [await ssim(item['path'], path) for item, path in outputs[:len(corpus)]]
+        result['ssim'] = round(sum(scores) / len(scores), 4)
+    for _, path in outputs:
+        os.unlink(path)
+    return result
+
+
+async def main(args) -> list:
+    corpus = await build_corpus(args.corpus, args.corpus_dir)
+    engine = FFmpegEngine()
+    policy = EncoderPolicy(None, adaptive=True)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='botq_tradeoff_') as work_dir:
+        for level in args.levels:
+            print(f"Level {level} ({ENCODER_LEVELS[level][0]})...", file=sys.stderr)
+            results.append(await run_level(engine, policy, level, corpus, args.repeat, work_dir, args.ssim))
+    reference = next((result for result in results if result['level'] == 2), results[0])
+    for result in results:
+        result['size_vs_level2'] = round(result['output_mb'] / reference['output_mb'], 3)
+        result['throughput_vs_level2'] = round(result['realtime_factor'] / reference['realtime_factor'], 3)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', choices=('quick', 'full'), default='quick')
+    parser.add_argument('--corpus-dir', default=DEFAULT_DIR)
+    parser.add_argument('--repeat', type=int, default=1, help='copies of the corpus encoded per level')
+    parser.add_argument('--levels', type=int, nargs='+', default=list(range(len(ENCODER_LEVELS))))
+    parser.add_argument('--ssim', action='store_true', help='also score each level against the source')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print(f"{'level':>5} {'preset':>10} {'crf':>4} {'thr':>4} {'slots':>5} {'x realtime':>10} "
+          f"{'jobs/min':>9} {'MB':>8} {'size':>6} {'speed':>6}" + (f" {'ssim':>7}" if args.ssim else ""))
+    for result in results:
+        print(f"{result['level']:>5} {result['preset']:>10} {result['crf']:>4} {result['threads_per_job']:>4} "
+              f"{result['slots']:>5} {result['realtime_factor']:>10} {result['jobs_per_minute']:>9} "
+              f"{result['output_mb']:>8} {result['size_vs_level2']:>6} {result['throughput_vs_level2']:>6}"
+              + (f" {result['ssim']:>7}" if args.ssim else ""))
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
@@ -0,0 +1,93 @@
+"""Compare single-process and segment-parallel encoding wall-clock time.
+
+Generates synthetic inputs with ffmpeg's lavfi sources and encodes each one
+with both strategies using the bot's own engine:
+
+    python benchmarks/segmented_encode.py --duration 120 --size 1920x1080 --workers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import AAC_ARGS, FFMPEG_BIN, FORMAT_MUXER_ARGS, H264_ARGS, FFmpegEngine, SegmentedEncoder
+
+
+async def generate_input(path: str, duration: float, size: str, rate: int) -> None:
+    """Write a synthetic H.264/AAC test clip with a 2 second GOP."""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(rate * 2),
+        '-pix_fmt', 'yuv420p', '-c:a', 'aac', path
+    )
+    if await process.wait() != 0:
+        raise SystemExit(f"Could not generate {path}")
+
+
+async def bench(args) -> list:
+    engine = FFmpegEngine()
+    video_args = H264_ARGS + ['-crf', '23']
+    muxer_args = FORMAT_MUXER_ARGS['mp4']
+    results = []
+    with tempfile.TemporaryDirectory(prefix='segbench_') as work_root:
+        for size in args.size:
+            input_path = os.path.join(work_root, f'input_{size}.mp4')
+            await generate_input(input_path, args.duration, size, args.rate)
+            info = await engine.probe(input_path)
+
+            single_path = os.path.join(work_root, f'single_{size}.mp4')
+            started = time.perf_counter()
+            await engine.run(['-i', input_path] + video_args + AAC_ARGS + muxer_args + [single_path])
+            single = time.perf_counter() - started
+
+            segmented_path = os.path.join(work_root, f'segmented_{size}.mp4')
+            segment_dir = os.path.join(work_root, f'segments_{size}')
+            os.makedirs(segment_dir)
+            started = time.perf_counter()
+            await SegmentedEncoder(engine, args.workers).run(
+                input_path, segmented_path, segment_dir, info, video_args, AAC_ARGS, muxer_args
+            )
+            segmented = time.perf_counter() - started
+
+            results.append({
+                'size': size,
+                'duration': args.duration,
+                'workers': args.workers,
+                'single_seconds': round(single, 2),
+                'segmented_seconds': round(segmented, 2),
+                'speedup': round(single / segmented, 2) if segmented else None,
+                'single_bytes': os.path.getsize(single_path),
+                'segmented_bytes': os.path.getsize(segmented_path),
+                'segmented_duration': engine.duration(await engine.probe(segmented_path)),
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=60, help='seconds of synthetic video per input')
+    parser.add_argument('--size', nargs='+', default=['1280x720', '1920x1080'], help='input resolutions')
+    parser.add_argument('--rate', type=int, default=30, help='input frame rate')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='parallel segment encoders')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(bench(args))
+    print(f"{'input':>10} {'single':>9} {'segmented':>10} {'speedup':>8}")
+    for result in results:
+        print(f"{result['size']:>10} {result['single_seconds']:>8.1f}s {result['segmented_seconds']:>9.1f}s "
+              f"{result['speedup']:>7.2f}x")
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Measure the bot's cold start: import time, baseline RSS and ffmpeg probe cost.
+
+Every run starts a fresh interpreter, as a new container or worker process
+would, imports bot.py, builds a VideoConverterBot and probes ffmpeg once:
+
+    python benchmarks/startup.py --runs 10 --budget-ms 1500 --budget-mb 80
+
+With budgets set the script exits with status 1 when the median exceeds them,
+so it can guard against heavy imports creeping back into bot.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+result = {'interpreter_rss_mb': rss_mb()}
+sys.path.insert(0, sys.argv[1])
+import bot
+result['import_ms'] = (time.perf_counter() - started) * 1000
+result['import_rss_mb'] = rss_mb()
+
+started = time.perf_counter()
+instance = bot.VideoConverterBot('123:startup-benchmark')
+result['construct_ms'] = (time.perf_counter() - started) * 1000
+result['rss_mb'] = rss_mb()
+
+import asyncio
+started = time.perf_counter()
+try:
+    capabilities = asyncio.run(instance.engine.probe_capabilities())
+    result['probe_ms'] = (time.perf_counter() - started) * 1000
+    result['ffmpeg'] = capabilities.version
+except bot.FFmpegError:
+    result['probe_ms'] = None
+    result['ffmpeg'] = None
+instance.journal.close()
+result['modules'] = len(sys.modules)
+print(json.dumps(result))
+'''
+
+
+def run_once(work_dir: str) -> dict:
+    env = dict(os.environ, TEMP_DIR=work_dir, JOB_JOURNAL_PATH=os.path.join(work_dir, 'jobs.db'))
+    child = subprocess.run([sys.executable, '-c', CHILD, ROOT], env=env, capture_output=True, text=True)
+    if child.returncode != 0:
+        raise RuntimeError(child.stderr.strip())
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    """Modules with the largest cumulative import time, from python -X importtime."""
+    env = dict(os.environ, TEMP_DIR=tempfile.mkdtemp(prefix='botq_startup_'))
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bot'], cwd=ROOT, env=env,
+                           capture_output=True, text=True)
+    rows = []
+    for line in child.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only top-level packages: their cumulative time includes the submodules
+        if name.startswith('   '):
+            continue
+        rows.append((int(cumulative), name.strip()))
+    return [{'module': name, 'cumulative_ms': round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:top]]
+
+
+def summarize(runs: list) -> dict:
+    def median(key):
+        values = [run[key] for run in runs if run[key] is not None]
+        return round(statistics.median(values), 1) if values else None
+    return {
+        'runs': len(runs),
+        'import_ms': median('import_ms'),
+        'construct_ms': median('construct_ms'),
+        'probe_ms': median('probe_ms'),
+        'interpreter_rss_mb': median('interpreter_rss_mb'),
+        'import_rss_mb': median('import_rss_mb'),
+        'rss_mb': median('rss_mb'),
+        'modules': runs[0]['modules'],
+        'ffmpeg': runs[0]['ffmpeg'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to start')
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports to list')
+    parser.add_argument('--budget-ms', type=float, help='fail when the median import time exceeds this')
+    parser.add_argument('--budget-mb', type=float, help='fail when the median RSS after startup exceeds this')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='botq_startup_') as work_dir:
+        summary = summarize([run_once(work_dir) for _ in range(args.runs)])
+    summary['slowest_imports'] = slowest_imports(args.top)
+
+    print(f"import {summary['import_ms']} ms, construct {summary['construct_ms']} ms, "
+          f"ffmpeg probe {summary['probe_ms']} ms (ffmpeg {summary['ffmpeg'] or 'not found'})")
+    print(f"RSS {summary['interpreter_rss_mb']} MB bare interpreter, {summary['import_rss_mb']} MB after import, "
+          f"{summary['rss_mb']} MB after startup; {summary['modules']} modules loaded")
+    print(f"{'module':<32} {'cumulative ms':>14}")
+    for row in summary['slowest_imports']:
+        print(f"{row['module']:<32} {row['cumulative_ms']:>14}")
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(summary, output, indent=2)
+
+    over = []
+    if args.budget_ms is not None and summary['import_ms'] > args.budget_ms:
+        over.append(f"import time {summary['import_ms']} ms > {args.budget_ms} ms")
+    if args.budget_mb is not None and summary['rss_mb'] > args.budget_mb:
+        over.append(f"RSS {summary['rss_mb']} MB > {args.budget_mb} MB")
+    if over:
+        print(f"over budget: {'; '.join(over)}")
+        sys.exit(1)
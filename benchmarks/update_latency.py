@@ -0,0 +1,104 @@
+"""Compare update-handling latency between polling and webhook modes.
+
+Replays synthetic text updates from distinct chats through a local Bot API
+stand-in and measures the time from delivery to the bot's reply:
+
+    python benchmarks/update_latency.py --updates 500 --api-delay 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+API_PORT = 18081
+BOT_HTTP_PORT = 18080
+
+# The bot reads its settings at import time
+os.environ.setdefault('TEMP_DIR', tempfile.mkdtemp(prefix='botq_bench_'))
+os.environ.setdefault('JOB_JOURNAL_PATH', os.path.join(tempfile.mkdtemp(prefix='botq_journal_'), 'jobs.db'))
+os.environ['METRICS_PORT'] = str(BOT_HTTP_PORT)
+os.environ['WEBHOOK_URL'] = f'http://127.0.0.1:{BOT_HTTP_PORT}'
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import TOKEN, FakeBotAPI, text_update
+from bot import VideoConverterBot
+
+
+def summarize(mode: str, concurrency: int, latencies: list, wall: float) -> dict:
+    def percentile(q):
+        return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'updates': len(latencies),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'max_ms': round(latencies[-1] * 1000, 1),
+        'updates_per_second': round(len(latencies) / wall, 1),
+    }
+
+
+async def run_mode(mode: str, count: int, concurrency: int, api_delay: float) -> dict:
+    api = FakeBotAPI(API_PORT, api_delay)
+    await api.start()
+    bot = VideoConverterBot(TOKEN, base_url=api.base_url, concurrent_updates=concurrency)
+    updates = [text_update(index + 1, 10_000 + index, 'hello') for index in range(count)]
+    loop = asyncio.get_running_loop()
+    try:
+        if mode == 'polling':
+            application = bot.application
+            await application.initialize()
+            await bot.post_init(application)
+            await application.updater.start_polling(poll_interval=0.0, timeout=1)
+            await application.start()
+            started = loop.time()
+            api.enqueue(updates)
+            await api.wait_replies(count)
+            wall = loop.time() - started
+            await application.updater.stop()
+            await application.stop()
+            await bot.post_shutdown(application)
+            await application.shutdown()
+        else:
+            stop = asyncio.Event()
+            server = asyncio.create_task(bot.run_webhook(stop))
+            await api.webhook_set.wait()
+            started = loop.time()
+            await api.push(updates)
+            await api.wait_replies(count)
+            wall = loop.time() - started
+            stop.set()
+            await server
+    finally:
+        await api.stop()
+    return summarize(mode, concurrency, api.latencies(), wall)
+
+
+async def main(args) -> list:
+    results = []
+    for concurrency in args.concurrency:
+        for mode in ('polling', 'webhook'):
+            results.append(await run_mode(mode, args.updates, concurrency, args.api_delay))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=300, help='synthetic updates per run')
+    parser.add_argument('--api-delay', type=float, default=0.05, help='simulated Bot API round trip in seconds')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 64],
+                        help='MAX_CONCURRENT_UPDATES values to compare (1 = sequential)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print(f"{'mode':>8} {'conc':>5} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'upd/s':>7}")
+    for result in results:
+        print(f"{result['mode']:>8} {result['concurrency']:>5} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+              f"{result['max_ms']:>8} {result['updates_per_second']:>7}")
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# bot.py reads its settings at import: keep scratch files and the journal out of the checkout
+_scratch = tempfile.mkdtemp(prefix='botq_tests_')
+os.environ.setdefault('TEMP_DIR', os.path.join(_scratch, 'videos'))
+os.environ.setdefault('JOB_JOURNAL_PATH', os.path.join(_scratch, 'jobs.db'))
+os.environ.setdefault('JOB_QUEUE_PATH', os.path.join(_scratch, 'queue', 'jobs.db'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
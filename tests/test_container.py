@@ -0,0 +1,63 @@
+import pytest
+
+import bot
+
+
+def streams(fps='30/1', audio=()) -> dict:
+    video = {'codec_type': 'video', 'codec_name': 'h264', 'avg_frame_rate': fps}
+    tracks = [{'codec_type': 'audio', 'codec_name': codec, 'sample_rate': str(rate)} for codec, rate in audio]
+    return {'format': {'duration': '600'}, 'streams': [video] + tracks}
+
+
+def test_every_audio_track_is_counted():
+    info = streams('60/1', [('aac', 48000)] * 5)
+    rates = bot.moov_sample_rates(info)
+    assert rates == [60.0] + [48000 / 1024] * 5
+    one_track = bot.faststart_args(600, bot.moov_sample_rates(streams('60/1', [('aac', 48000)])))
+    five_tracks = bot.faststart_args(600, rates)
+    assert int(five_tracks[1]) > int(one_track[1])
+
+
+def test_reserve_covers_the_index_of_every_sample():
+    info = streams('60/1', [('aac', 48000)] * 5)
+    option, value = bot.faststart_args(600, bot.moov_sample_rates(info))
+    samples = 600 * (60 + 5 * 48000 / 1024)
+    assert option == '-moov_size'
+    assert int(value) >= samples * bot.MOOV_SAMPLE_BYTES + 6 * bot.MOOV_TRACK_BYTES
+
+
+def test_short_audio_frames_are_sized_as_aac_or_shorter():
+    rates = bot.moov_sample_rates(streams(audio=[('opus', 48000), ('ac3', 48000), ('pcm_s16le', 48000)]),
+                                  video=False)
+    assert rates == [48000 / 960, 48000 / 1024, 48000 / bot.MOOV_MIN_FRAME_SAMPLES]
+
+
+def test_cover_art_is_not_the_video_track():
+    info = streams(audio=[('aac', 44100)])
+    info['streams'].insert(0, {'codec_type': 'video', 'codec_name': 'mjpeg', 'avg_frame_rate': '90000/1',
+                               'disposition': {'attached_pic': 1}})
+    assert bot.moov_sample_rates(info) == [30.0, 44100 / 1024]
+
+
+@pytest.mark.parametrize('info, duration', [
+    (streams('90000/1'), 600),
+    (streams('0/0'), 600),
+    (streams(audio=[('aac', 0)]), 600),
+    (streams(), 0),
+])
+def test_unknown_rates_fall_back_to_faststart(info, duration):
+    assert bot.faststart_args(duration, bot.moov_sample_rates(info)) == ['-movflags', '+faststart']
+
+
+def test_container_args_only_reserve_for_mp4_and_mov():
+    info = streams(audio=[('aac', 44100)])
+    assert bot.container_args('mkv', info) == []
+    assert bot.container_args('mp4', info)[0] == '-moov_size'
+    assert int(bot.container_args('mov', info, 10)[1]) < int(bot.container_args('mov', info)[1])
+
+
+def test_without_moov_reserve_swaps_in_faststart():
+    args = ['-i', 'in.mp4', '-c', 'copy', '-moov_size', '123456', 'out.mp4']
+    assert bot.without_moov_reserve(args) == ['-i', 'in.mp4', '-c', 'copy', '-movflags', '+faststart', 'out.mp4']
+    segment = ['-segment_format_options', 'moov_size=4096']
+    assert bot.without_moov_reserve(segment) == ['-segment_format_options', 'movflags=+faststart']
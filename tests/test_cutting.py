@@ -0,0 +1,55 @@
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize('text, seconds', [
+    ('90', 90.0),
+    ('1:30', 90.0),
+    ('1:30.5', 90.5),
+    ('1:02:03', 3723.0),
+    (' 0:05 ', 5.0),
+    ('0', 0.0),
+])
+def test_parse_timestamp(text, seconds):
+    assert bot.parse_timestamp(text) == seconds
+
+
+@pytest.mark.parametrize('text', ['', 'abc', '1:2:3:4', '1:60', '1:00:60', '-5', '1:-3', '1::2'])
+def test_parse_timestamp_rejects(text):
+    assert bot.parse_timestamp(text) is None
+
+
+@pytest.mark.parametrize('seconds', [0, 5, 90.5, 3723, 3599.9])
+def test_format_timestamp_parses_back(seconds):
+    assert bot.parse_timestamp(bot.format_timestamp(seconds)) == pytest.approx(seconds)
+
+
+def test_cut_points_cut_at_the_last_keyframe_that_fits():
+    # A keyframe every 10s, 100 bytes apart
+    keyframes = [(second, second * 10) for second in range(0, 100, 10)]
+    assert bot.OutputSplitter.cut_points(keyframes, 1000, 250) == [20, 40, 60, 80]
+
+
+def test_cut_points_leave_a_file_that_fits_whole():
+    keyframes = [(0.0, 0), (2.0, 400), (4.0, 800)]
+    assert bot.OutputSplitter.cut_points(keyframes, 1000, 1000) == []
+
+
+def test_cut_points_keep_each_part_within_budget():
+    keyframes = [(0.0, 0), (1.5, 90), (3.0, 310), (4.5, 420), (6.0, 500), (7.5, 780)]
+    size, budget = 900, 400
+    cuts = bot.OutputSplitter.cut_points(keyframes, size, budget)
+    positions = dict(keyframes)
+    bounds = [0] + [positions[cut] for cut in cuts] + [size]
+    assert all(later - earlier <= budget for earlier, later in zip(bounds, bounds[1:]))
+    assert cuts == [3.0, 6.0]
+
+
+@pytest.mark.parametrize('keyframes, size', [
+    ([(0.0, 0), (10.0, 500)], 600),
+    ([(0.0, 0), (10.0, 100)], 700),
+])
+def test_cut_points_refuse_a_keyframe_interval_over_budget(keyframes, size):
+    with pytest.raises(bot.FFmpegError):
+        bot.OutputSplitter.cut_points(keyframes, size, 400)
@@ -0,0 +1,51 @@
+import bot
+
+
+def policy(cores: int = 16, base: int = 2, max_jobs: int = 0, backlog=None) -> bot.EncoderPolicy:
+    scheduler = bot.TranscodeScheduler(slots=base)
+    encoder_policy = bot.EncoderPolicy(scheduler, adaptive=True, cores=cores, max_jobs=max_jobs, backlog=backlog)
+    encoder_policy.sample_utilization = lambda: 1.0
+    return encoder_policy
+
+
+def test_slots_default_to_the_policy_cores():
+    encoder_policy = policy(cores=16)
+    assert encoder_policy.max_jobs == 16
+    encoder_policy.level = len(bot.ENCODER_LEVELS) - 1
+    assert encoder_policy.slots == 16
+    assert policy(cores=16, max_jobs=6).max_jobs == 6
+
+
+def test_load_is_measured_against_the_base_slots():
+    encoder_policy = policy(base=2)
+    encoder_policy.level = 0
+    assert encoder_policy.target_level(0, 1, 0.2) == 0
+    assert encoder_policy.target_level(0, 2, 0.9) == 1
+    assert encoder_policy.target_level(3, 2, 0.9) == 3
+    assert encoder_policy.target_level(40, 2, 0.9) == 4
+
+
+def test_a_steady_backlog_settles_on_one_level():
+    # The worker's queue is the backlog; opening more slots must not read as less load
+    encoder_policy = policy(cores=16, base=2, backlog=lambda: 48)
+    levels = [encoder_policy.update() for _ in range(12)]
+    assert levels[-6:] == [levels[-1]] * 6
+    assert encoder_policy.preset == 'ultrafast'
+    assert encoder_policy.scheduler.slots == 16
+
+
+def test_hysteresis_holds_a_level_until_load_clearly_drops():
+    encoder_policy = policy(base=4)
+    encoder_policy.level = 3
+    # Load 1.75 is under the step at 2, but not by the hysteresis margin
+    assert encoder_policy.target_level(3, 4, 0.9) == 3
+    assert encoder_policy.target_level(2, 4, 0.9) == 2
+    assert encoder_policy.target_level(0, 2, 0.2) == 0
+
+
+def test_update_moves_one_level_at_a_time():
+    pending = [48]
+    encoder_policy = policy(backlog=lambda: pending[0])
+    assert [encoder_policy.update() for _ in range(3)] == [3, 4, 4]
+    pending[0] = 0
+    assert [encoder_policy.update() for _ in range(5)] == [3, 2, 1, 1, 1]
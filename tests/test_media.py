@@ -0,0 +1,17 @@
+from types import SimpleNamespace
+
+import bot
+
+
+def test_local_file_path_never_returns_a_url(tmp_path):
+    url = 'https://api.telegram.org/file/bot123:SECRET/videos/file_0.mp4'
+    assert bot.local_file_path(SimpleNamespace(file_path=url)) is None
+    assert bot.local_file_path(SimpleNamespace(file_path=None)) is None
+
+
+def test_local_file_path_reads_a_shared_volume_in_place(tmp_path):
+    video = tmp_path / 'file_0.mp4'
+    video.write_bytes(b'\0')
+    assert bot.local_file_path(SimpleNamespace(file_path=str(video))) == str(video)
+    # A local server's path this host cannot see is downloaded instead
+    assert bot.local_file_path(SimpleNamespace(file_path=str(tmp_path / 'missing.mp4'))) is None
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+import bot
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = bot.TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take(now)
+    assert bucket.delay(now) == 0.5
+    assert bucket.delay(now + 0.5) == 0
+    assert not bucket.idle(now + 0.5)
+    assert bucket.idle(now + 1.5)
+
+
+def test_token_bucket_pause_holds_everything_then_allows_one():
+    bucket = bot.TokenBucket(rate=1, burst=3)
+    bucket.pause(5)
+    now = time.monotonic()
+    assert 4 < bucket.delay(now) <= 5
+    resumed = bucket.paused_until
+    assert bucket.delay(resumed) == 0
+    bucket.take(resumed)
+    assert bucket.delay(resumed) == 1
+
+
+def test_edits_of_one_message_coalesce_to_the_latest():
+    async def scenario():
+        outbox = bot.Outbox()
+        sent = []
+
+        def edit(text):
+            async def call():
+                sent.append(text)
+                return text
+            return call
+
+        # Queued before the outbox task gets to run, so all three wait together
+        futures = [outbox.submit(1, edit(text), bot.PRIORITY_PROGRESS, key=(1, 10)) for text in ('10%', '20%', '30%')]
+        results = await asyncio.wait_for(asyncio.gather(*futures), 1)
+        outbox.close()
+        return sent, results, outbox.coalesced
+
+    sent, results, coalesced = asyncio.run(scenario())
+    assert sent == ['30%']
+    assert results == [None, None, '30%']
+    assert coalesced == 2
+
+
+def test_waiting_requests_go_out_in_priority_order():
+    async def scenario():
+        outbox = bot.Outbox()
+        sent = []
+
+        def call(name):
+            async def send():
+                sent.append(name)
+            return send
+
+        futures = [
+            outbox.submit(1, call('progress'), bot.PRIORITY_PROGRESS, key=(1, 10)),
+            outbox.submit(1, call('status'), bot.PRIORITY_STATUS),
+            outbox.submit(1, call('result'), bot.PRIORITY_RESULT),
+        ]
+        await asyncio.wait_for(asyncio.gather(*futures), 1)
+        outbox.close()
+        return sent
+
+    assert asyncio.run(scenario()) == ['result', 'status', 'progress']
+
+
+def test_retry_after_pauses_the_chat_and_requeues_the_request():
+    async def scenario():
+        outbox = bot.Outbox()
+        attempts = []
+
+        async def send():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.2)
+            return 'sent'
+
+        result = await asyncio.wait_for(outbox.submit(1, send), 2)
+        outbox.close()
+        return result, attempts, outbox.flood_waits
+
+    result, attempts, flood_waits = asyncio.run(scenario())
+    assert result == 'sent'
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.2
+    assert flood_waits == 1
+
+
+def test_retry_after_drops_an_edit_a_newer_one_replaced():
+    async def scenario():
+        outbox = bot.Outbox()
+        sent = []
+        first_on_wire = asyncio.Event()
+        newer_queued = asyncio.Event()
+
+        async def stale():
+            first_on_wire.set()
+            await newer_queued.wait()
+            raise RetryAfter(0.1)
+
+        async def latest():
+            sent.append('latest')
+            return 'latest'
+
+        stale_future = outbox.submit(1, stale, bot.PRIORITY_PROGRESS, key=(1, 10))
+        await first_on_wire.wait()
+        latest_future = outbox.submit(1, latest, bot.PRIORITY_PROGRESS, key=(1, 10))
+        newer_queued.set()
+        results = await asyncio.wait_for(asyncio.gather(stale_future, latest_future), 2)
+        outbox.close()
+        return results, sent
+
+    results, sent = asyncio.run(scenario())
+    assert results == [None, 'latest']
+    assert sent == ['latest']
@@ -0,0 +1,112 @@
+import pytest
+
+import bot
+
+
+def probe(width=1920, height=1080, fps='30/1', duration=30.0, size=50_000_000, rotate=None) -> dict:
+    video = {'codec_type': 'video', 'codec_name': 'h264', 'width': width, 'height': height, 'avg_frame_rate': fps}
+    if rotate is not None:
+        video['tags'] = {'rotate': str(rotate)}
+    return {
+        'format': {'duration': str(duration), 'size': str(size)},
+        'streams': [video, {'codec_type': 'audio', 'codec_name': 'aac', 'bit_rate': '128000'}],
+    }
+
+
+def test_plan_gif_keeps_a_short_clip_whole_at_full_quality():
+    plan = bot.plan_gif(probe(320, 240, '25/1', 5.0))
+    assert (plan.width, plan.height, plan.fps) == (320, 240, bot.GIF_FPS_STEPS[0])
+    assert plan.duration == 5.0 and not plan.trimmed
+    assert plan.predicted_size == int(plan.pixels * bot.GIF_BYTES_PER_PIXEL)
+
+
+def test_plan_gif_picks_the_richest_plan_under_target():
+    target = 2_000_000
+    plan = bot.plan_gif(probe(), target)
+    assert plan.predicted_size <= target
+    richer = [
+        bot.fit_size(1920, 1080, longest)[0] * bot.fit_size(1920, 1080, longest)[1] * fps
+        for longest in bot.GIF_SIZE_STEPS for fps in bot.GIF_FPS_STEPS
+    ]
+    fitting = [rate for rate in richer if rate * plan.duration * bot.GIF_BYTES_PER_PIXEL <= target]
+    assert plan.width * plan.height * plan.fps == max(fitting)
+
+
+def test_plan_gif_caps_length_and_frame_rate():
+    plan = bot.plan_gif(probe(640, 360, '8/1', 120.0))
+    assert plan.duration == bot.GIF_MAX_DURATION and plan.trimmed
+    assert plan.fps <= 8
+
+
+def test_plan_gif_follows_rotation():
+    plan = bot.plan_gif(probe(1280, 720, rotate=90), 2_000_000)
+    assert plan.height > plan.width
+
+
+def test_plan_gif_shortens_a_clip_nothing_fits():
+    target = 200_000
+    plan = bot.plan_gif(probe(), target)
+    assert plan.trimmed
+    assert (plan.width, plan.fps) == (bot.GIF_TRIM_SIZE, bot.GIF_TRIM_FPS)
+    assert bot.GIF_MIN_DURATION <= plan.duration < 30
+    assert plan.pixels * bot.GIF_BYTES_PER_PIXEL == pytest.approx(target)
+
+
+@pytest.mark.parametrize('info, target', [
+    (probe(), 50_000),
+    ({'format': {'duration': '10'}, 'streams': [{'codec_type': 'audio'}]}, bot.GIF_TARGET_SIZE),
+])
+def test_plan_gif_refuses(info, target):
+    with pytest.raises(bot.GifPlanError):
+        bot.plan_gif(info, target)
+
+
+def media(**kwargs) -> bot.MediaInfo:
+    info = probe(**kwargs)
+    return bot.MediaInfo.from_probe(info)
+
+
+def test_cost_model_sizes_compression_by_its_profile():
+    model = bot.CostModel()
+    source = media()
+    for level, (share, _) in bot.COMPRESSION_PROFILES.items():
+        estimate = model.estimate(source, {'action': 'compress', 'compression': level})
+        assert estimate.output_size == int(source.size * share)
+
+
+def test_cost_model_trim_copies_the_kept_share():
+    model = bot.CostModel()
+    source = media(duration=100.0, size=10_000_000)
+    kind, units, output_size = model.plan(source, {'action': 'trim', 'trim_start': 20, 'trim_end': 45})
+    assert kind == 'copy'
+    assert units == output_size == 2_500_000
+
+
+def test_cost_model_bigger_output_takes_longer():
+    model = bot.CostModel()
+    source = media()
+    small = model.estimate(source, {'action': 'resolution', 'resolution': 360})
+    large = model.estimate(source, {'action': 'resolution', 'resolution': 1080})
+    assert small.encode_seconds < large.encode_seconds
+    assert small.download_seconds == large.download_seconds == source.size / bot.DOWNLOAD_BYTES_RATE
+    assert model.estimate(source, {'action': 'compress'}, local_input=True).download_seconds == 0
+
+
+def test_cost_model_learns_from_finished_jobs():
+    model = bot.CostModel()
+    source = media()
+    params = {'action': 'compress', 'compression': 'medium'}
+    predicted = model.estimate(source, params).encode_seconds
+    measured = predicted * 4
+    for _ in range(20):
+        model.observe(source, params, measured)
+    assert model.estimate(source, params).encode_seconds == pytest.approx(measured, rel=0.01)
+    # Other actions keep their own rates
+    assert model.rate('encode', 'resolution') == bot.ENCODE_MPIX_RATE
+
+
+def test_cost_model_follows_download_speed():
+    model = bot.CostModel()
+    for _ in range(30):
+        model.observe_download(10_000_000, 10.0)
+    assert model.download_rate == pytest.approx(1_000_000, rel=0.01)
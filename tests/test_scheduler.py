@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import bot
+
+
+def make_job(user_id: int, cost: float, started: list, gate: asyncio.Event, waited: float = 0.0) -> bot.ConversionJob:
+    async def runner(job):
+        started.append(job)
+        await gate.wait()
+
+    job = bot.ConversionJob(user_id, user_id, {}, runner)
+    job.cost = cost
+    job.created = time.monotonic() - waited
+    return job
+
+
+async def run_one_at_a_time(jobs: list, scheduler: bot.TranscodeScheduler, started: list, gates: dict) -> list:
+    """Submit jobs behind a blocker, then let them through one by one; returns the start order."""
+    for job in jobs:
+        scheduler.submit(job)
+    while len(started) < len(jobs):
+        await asyncio.sleep(0)
+        for job in started:
+            gates[job.id].set()
+    for gate in gates.values():
+        gate.set()
+    await asyncio.gather(*(job.task for job in jobs))
+    return started
+
+
+def schedule(specs: list, slots: int = 1, per_user: int = 10) -> list:
+    """Start order of jobs given as (name, user_id, cost, seconds waited), after a blocker."""
+    async def scenario():
+        scheduler = bot.TranscodeScheduler(slots=slots, per_user=per_user, prefetch=0)
+        started, gates, names = [], {}, {}
+        jobs = []
+        for name, user_id, cost, waited in [('blocker', 0, 1, 0)] + specs:
+            gate = asyncio.Event()
+            job = make_job(user_id, cost, started, gate, waited)
+            gates[job.id] = gate
+            names[job.id] = name
+            jobs.append(job)
+        order = await asyncio.wait_for(run_one_at_a_time(jobs, scheduler, started, gates), 5)
+        return [names[job.id] for job in order]
+
+    return asyncio.run(scenario())
+
+
+def test_shortest_job_starts_first():
+    order = schedule([('long', 1, 600, 0), ('medium', 2, 120, 0), ('short', 3, 10, 0)])
+    assert order == ['blocker', 'short', 'medium', 'long']
+
+
+def test_a_long_wait_ages_a_big_job_ahead():
+    # 600s of work that has waited 400s ranks at 600 - SJF_AGING * 400
+    order = schedule([('short', 1, 10, 0), ('aged', 2, 600, 400)])
+    assert bot.SJF_AGING * 400 > 600 - 10
+    assert order == ['blocker', 'aged', 'short']
+
+
+def test_unknown_cost_counts_as_the_default():
+    job = bot.ConversionJob(1, 1, {}, None)
+    now = job.created
+    assert bot.TranscodeScheduler.priority(job, now) == bot.DEFAULT_JOB_COST
+    assert bot.TranscodeScheduler.priority(job, now + 10) == bot.DEFAULT_JOB_COST - bot.SJF_AGING * 10
+
+
+def test_per_user_cap_lets_other_users_overtake():
+    # The blocker's user may not start a second job while the first runs
+    order = schedule([('same user', 0, 1, 0), ('other user', 1, 600, 0)], slots=2, per_user=1)
+    assert order[:2] == ['blocker', 'other user']
+
+
+def test_queue_positions_follow_the_start_order():
+    async def scenario():
+        scheduler = bot.TranscodeScheduler(slots=1, prefetch=0)
+        started, gate = [], asyncio.Event()
+        blocker = make_job(0, 1, started, gate)
+        long_job = make_job(1, 600, started, gate)
+        short_job = make_job(2, 10, started, gate)
+        scheduler.submit(blocker)
+        positions = [scheduler.submit(long_job), scheduler.submit(short_job)]
+        positions += [scheduler.position(long_job), scheduler.position(short_job)]
+        gate.set()
+        await asyncio.gather(*(job.task for job in (blocker,)))
+        scheduler.cancel_user(1)
+        scheduler.cancel_user(2)
+        return positions
+
+    assert asyncio.run(scenario()) == [1, 1, 2, 1]
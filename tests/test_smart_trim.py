@@ -0,0 +1,136 @@
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import bot
+
+# Keyframe grids: whole seconds, and NTSC 29.97 fps with a 91 frame GOP, whose keyframe
+# times are no whole milliseconds (frame 91 is at 3.036367s)
+GRIDS = {'seconds': ('25/1', 25), 'ntsc': ('30000/1001', 91)}
+DURATION = 10
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(bot.FFMPEG_BIN) is None, reason="needs ffmpeg")
+
+
+def keyframe_times(grid: str) -> list:
+    """Keyframe times as ffprobe prints them, to the microsecond."""
+    rate, gop = GRIDS[grid]
+    numerator, denominator = map(int, rate.split('/'))
+    interval = gop * denominator / numerator
+    return [round(index * interval, 6) for index in range(int(DURATION / interval) + 1)]
+
+
+def encode_source(path, encoder: str, profile: str, grid: str) -> None:
+    """A clip with a fixed GOP, B-frames and tagged BT.709 colour."""
+    rate, gop = GRIDS[grid]
+    subprocess.run([
+        bot.FFMPEG_BIN, '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size=320x240:rate={rate}:duration={DURATION}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={DURATION}',
+        '-c:v', encoder, '-profile:v', profile, '-pix_fmt', 'yuv420p', '-g', str(gop), '-keyint_min', str(gop),
+        '-bf', '2', '-color_primaries', 'bt709', '-color_trc', 'bt709', '-colorspace', 'bt709',
+        *(['-sc_threshold', '0'] if encoder == 'libx264' else ['-x265-params', 'scenecut=0:log-level=error']),
+        '-c:a', 'aac', '-shortest', str(path),
+    ], check=True)
+
+
+def source_info(codec: str, profile: str, level: int, grid: str = 'seconds') -> dict:
+    return {
+        'format': {'duration': str(DURATION), 'start_time': '0'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': codec, 'profile': profile, 'level': level, 'pix_fmt': 'yuv420p',
+             'color_primaries': 'bt709', 'color_transfer': 'bt709', 'color_space': 'bt709',
+             'avg_frame_rate': GRIDS[grid][0], 'sample_aspect_ratio': '1:1'},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'sample_rate': '44100'},
+        ],
+    }
+
+
+def trimmer(grid: str, encoders: frozenset = None) -> bot.SmartTrimmer:
+    engine = bot.FFmpegEngine()
+    if encoders is None:
+        encoders = bot.FFmpegCapabilities.listed(asyncio.run(engine.query(bot.FFMPEG_BIN, '-hide_banner', '-encoders')))
+    engine.capabilities = bot.FFmpegCapabilities(version='test', encoders=encoders, filters=frozenset())
+
+    # The source's keyframes are known, ffprobe is not needed to find them
+    async def keyframes(path, start, end):
+        return [time for time in keyframe_times(grid) if start - 5 <= time <= end + 5]
+    engine.keyframes = keyframes
+    return bot.SmartTrimmer(engine)
+
+
+def test_pieces_meet_at_keyframes_off_the_millisecond_grid(tmp_path):
+    smart = trimmer('ntsc', frozenset({'libx264'}))
+    runs = []
+
+    async def run(args, duration=0.0, on_progress=None, job=None, stdin_source=None):
+        runs.append(args)
+    smart.engine.run = run
+    asyncio.run(smart.run('in.mp4', str(tmp_path / 'out.mp4'), str(tmp_path), source_info('h264', 'High', 30, 'ntsc'),
+                          1.4, 8.0))
+
+    first, last = 91 * 1001 / 30000, 182 * 1001 / 30000
+    frame = 1001 / 30000
+    pieces = {os.path.basename(args[-1]): args for args in runs if args[-1].endswith('.ts')}
+    assert set(pieces) == {'head.ts', 'middle%d.ts', 'tail.ts'}
+    head, middle, tail = ((float(args[1]), float(args[1]) + float(args[5]))
+                          for args in (pieces['head.ts'], pieces['middle%d.ts'], pieces['tail.ts']))
+    # The copy's seek lands on its own keyframe, not the one a GOP before
+    assert first <= middle[0] < first + frame / 2
+    # The re-encoded head ends after the frame before the first keyframe, and before the keyframe
+    assert first - frame / 2 < head[1] < first
+    # The copy is split at the last keyframe by presentation time; only its first part is joined
+    split = float(pieces['middle%d.ts'][pieces['middle%d.ts'].index('-segment_times') + 1])
+    assert middle[0] < first + split < last
+    # The exact seek of the tail keeps the keyframe's frame and nothing before it
+    assert last - frame / 2 < tail[0] <= last
+    assert "file 'middle0.ts'" in (tmp_path / 'pieces.txt').read_text()
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize('grid', list(GRIDS))
+@pytest.mark.parametrize('encoder, codec, profile, ffprobe_profile, level, tag', [
+    ('libx264', 'h264', 'high', 'High', 30, 'avc3'),
+    ('libx265', 'hevc', 'main', 'Main', 90, 'hev1'),
+])
+def test_exact_cut_decodes_across_both_joins(tmp_path, grid, encoder, codec, profile, ffprobe_profile, level, tag):
+    smart = trimmer(grid)
+    if not smart.engine.capabilities.has_encoder(encoder):
+        pytest.skip(f"ffmpeg lacks {encoder}")
+    source = tmp_path / 'source.mp4'
+    encode_source(source, encoder, profile, grid)
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+
+    # The ends up to the first and from the last keyframe in range are re-encoded, the GOPs between copied
+    start, end = 1.4, 8.0
+    output = asyncio.run(smart.run(str(source), str(tmp_path / 'out.mp4'), str(work_dir),
+                                   source_info(codec, ffprobe_profile, level, grid), start, end))
+
+    decode = subprocess.run(
+        [bot.FFMPEG_BIN, '-v', 'error', '-xerror', '-i', output, '-map', '0:v', '-f', 'framecrc', '-'],
+        capture_output=True, text=True
+    )
+    assert decode.returncode == 0, decode.stderr
+    assert decode.stderr.strip() == ''
+    frames = [line for line in decode.stdout.splitlines() if line and not line.startswith('#')]
+    # A piece starting a GOP early, or ending one short, is off by a whole GOP
+    numerator, denominator = map(int, GRIDS[grid][0].split('/'))
+    assert abs(len(frames) - (end - start) * numerator / denominator) <= 2
+
+    header = subprocess.run([bot.FFMPEG_BIN, '-hide_banner', '-i', output], capture_output=True, text=True).stderr
+    video = next(line for line in header.splitlines() if 'Video:' in line)
+    assert f'({tag} /' in video
+    assert re.search(rf'{codec} \({ffprobe_profile}\)', video)
+
+
+def test_cut_without_video_stream_is_refused(tmp_path):
+    info = {'format': {'duration': '8.0'}, 'streams': [{'codec_type': 'audio', 'codec_name': 'aac'}]}
+    smart = bot.SmartTrimmer(bot.FFmpegEngine())
+    for exact in (True, False):
+        with pytest.raises(bot.NoVideoStreamError):
+            asyncio.run(smart.run('in.mp4', str(tmp_path / 'out.mp4'), str(tmp_path), info, 1.0, 2.0, exact))
@@ -0,0 +1,75 @@
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update, User
+
+import bot
+
+
+def update(update_id: int, chat_id: int, user_id: int) -> Update:
+    message = Message(
+        message_id=update_id, date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(chat_id, Chat.PRIVATE if chat_id > 0 else Chat.GROUP),
+        from_user=User(user_id, 'user', False), text='hi',
+    )
+    return Update(update_id, message=message)
+
+
+async def process(processor: bot.PerChatUpdateProcessor, updates: list) -> tuple:
+    """Run every update's handler at once; returns the handlers' (name, event) log and peak concurrency."""
+    log, running, peak = [], set(), [0]
+
+    async def handler(name):
+        running.add(name)
+        peak[0] = max(peak[0], len(running))
+        log.append((name, 'start'))
+        await asyncio.sleep(0.01)
+        log.append((name, 'end'))
+        running.discard(name)
+
+    await asyncio.gather(*(processor.process_update(item, handler(name)) for name, item in updates))
+    return log, peak[0]
+
+
+def test_one_chat_is_handled_one_update_at_a_time_in_order():
+    processor = bot.PerChatUpdateProcessor(8)
+    updates = [(name, update(index, 1, 1)) for index, name in enumerate('abc')]
+    log, peak = asyncio.run(process(processor, updates))
+    assert peak == 1
+    assert log == [('a', 'start'), ('a', 'end'), ('b', 'start'), ('b', 'end'), ('c', 'start'), ('c', 'end')]
+    assert processor._locks == {}
+
+
+def test_different_chats_and_users_run_side_by_side():
+    processor = bot.PerChatUpdateProcessor(8)
+    updates = [('chat 1', update(1, 1, 1)), ('chat 2', update(2, 2, 2)), ('group user 3', update(3, -5, 3)),
+               ('group user 4', update(4, -5, 4))]
+    _, peak = asyncio.run(process(processor, updates))
+    assert peak == 4
+
+
+def test_the_global_limit_still_applies():
+    processor = bot.PerChatUpdateProcessor(2)
+    updates = [(str(chat), update(chat, chat, chat)) for chat in range(1, 6)]
+    _, peak = asyncio.run(process(processor, updates))
+    assert peak == 2
+
+
+def test_a_flooding_chat_holds_one_slot():
+    processor = bot.PerChatUpdateProcessor(2)
+    updates = [(f'flood {index}', update(index, 1, 1)) for index in range(5)] + [('other', update(9, 2, 2))]
+
+    async def scenario():
+        log, _ = await process(processor, updates)
+        return log
+
+    log = asyncio.run(scenario())
+    # The other chat does not wait behind the flood's queue
+    assert log.index(('other', 'end')) < log.index(('flood 2', 'start'))
+
+
+def test_updates_without_a_chat_are_not_serialised():
+    processor = bot.PerChatUpdateProcessor(8)
+    updates = [(name, object()) for name in 'abc']
+    _, peak = asyncio.run(process(processor, updates))
+    assert peak == 3